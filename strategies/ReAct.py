@@ -31,7 +31,7 @@ from output_parser.cot_output_parser import CotAgentOutputParser
 from prompt.template import REACT_PROMPT_TEMPLATES
 from utils.mcp_client import McpClients
 
-ignore_observation_providers = ["wenxin"]
+ignore_observation_providers = frozenset({"wenxin"})
 
 
 class ReActParams(BaseModel):
@@ -59,6 +59,8 @@ class ReActAgentStrategy(AgentStrategy):
         self.instruction = ""
         self.history_prompt_messages = []
         self.prompt_messages_tools = []
+        # the tools section of the system prompt, rebuilt only when the prompt tools change
+        self._prompt_tools_json: str | None = None
 
     @property
     def _user_prompt_message(self) -> UserPromptMessage:
@@ -75,18 +77,20 @@ class ReActAgentStrategy(AgentStrategy):
         if not prompt_entity:
             raise ValueError("Agent prompt configuration is not set")
         first_prompt = prompt_entity.first_prompt
+        if self._prompt_tools_json is None:
+            self._prompt_tools_json = json.dumps(
+                [
+                    tool.model_dump(mode="json")
+                    for tool in self._prompt_messages_tools
+                ],
+                ensure_ascii=False
+            )
 
         system_prompt = (
             first_prompt.replace("{{instruction}}", self.instruction)
             .replace(
                 "{{tools}}",
-                json.dumps(
-                    [
-                        tool.model_dump(mode="json")
-                        for tool in self._prompt_messages_tools
-                    ],
-                    ensure_ascii=False
-                ),
+                self._prompt_tools_json,
             )
             .replace(
                 "{{tool_names}}",
@@ -148,250 +152,260 @@ class ReActAgentStrategy(AgentStrategy):
             except json.JSONDecodeError as e:
                 raise ValueError(f"mcp_servers_config must be a valid JSON string: {e}")
             mcp_clients = McpClients(servers_config)
-            mcp_tools = mcp_clients.fetch_tools()
+            try:
+                mcp_tools = mcp_clients.fetch_tools()
+            except Exception:
+                # do not leak SSE listeners or stdio processes when listing tools fails
+                mcp_clients.close()
+                raise
             mcp_tool_instances = {tool.get("name"): tool for tool in mcp_tools} if mcp_tools else {}
 
-        react_params.model.completion_params = (
-                react_params.model.completion_params or {}
-        )
-        # convert tools into ModelRuntime Tool format
-        prompt_messages_tools = self._init_prompt_tools(tools)
-        prompt_messages_tools.extend(self._init_prompt_mcp_tools(mcp_tools))
-        self._prompt_messages_tools = prompt_messages_tools
-
-        while run_agent_state and iteration_step <= max_iteration_steps:
-            # continue to run until there is not any tool call
-            run_agent_state = False
-            round_started_at = time.perf_counter()
-            round_log = self.create_log_message(
-                label=f"ROUND {iteration_step}",
-                data={},
-                metadata={
-                    LogMetadata.STARTED_AT: round_started_at,
-                },
-                status=ToolInvokeMessage.LogMessage.LogStatus.START,
+        try:
+            react_params.model.completion_params = (
+                    react_params.model.completion_params or {}
             )
-            yield round_log
-            if iteration_step == max_iteration_steps:
-                # the last iteration, remove all tools
-                self._prompt_messages_tools = []
+            # convert tools into ModelRuntime Tool format
+            prompt_messages_tools = self._init_prompt_tools(tools)
+            prompt_messages_tools.extend(self._init_prompt_mcp_tools(mcp_tools))
+            self._prompt_messages_tools = prompt_messages_tools
+            self._prompt_tools_json = None
+            prompt_tools_by_name = {
+                prompt_tool.name: prompt_tool for prompt_tool in prompt_messages_tools if prompt_tool.name in tool_instances
+            }
 
-            message_file_ids: list[str] = []
+            while run_agent_state and iteration_step <= max_iteration_steps:
+                # continue to run until there is not any tool call
+                run_agent_state = False
+                round_started_at = time.perf_counter()
+                round_log = self.create_log_message(
+                    label=f"ROUND {iteration_step}",
+                    data={},
+                    metadata={
+                        LogMetadata.STARTED_AT: round_started_at,
+                    },
+                    status=ToolInvokeMessage.LogMessage.LogStatus.START,
+                )
+                yield round_log
+                if iteration_step == max_iteration_steps:
+                    # the last iteration, remove all tools
+                    self._prompt_messages_tools = []
+                    self._prompt_tools_json = None
 
-            # recalc llm max tokens
-            prompt_messages = self._organize_prompt_messages(
-                agent_scratchpad, self.query
-            )
-            if model.entity and model.completion_params:
-                self.recalc_llm_max_tokens(
-                    model.entity, prompt_messages, model.completion_params
+                message_file_ids: list[str] = []
+
+                # recalc llm max tokens
+                prompt_messages = self._organize_prompt_messages(
+                    agent_scratchpad, self.query
+                )
+                if model.entity and model.completion_params:
+                    self.recalc_llm_max_tokens(
+                        model.entity, prompt_messages, model.completion_params
+                    )
+                # invoke model
+                chunks = self.session.model.llm.invoke(
+                    model_config=LLMModelConfig(**model.model_dump(mode="json")),
+                    prompt_messages=prompt_messages,
+                    stream=True,
+                    stop=stop,
                 )
-            # invoke model
-            chunks = self.session.model.llm.invoke(
-                model_config=LLMModelConfig(**model.model_dump(mode="json")),
-                prompt_messages=prompt_messages,
-                stream=True,
-                stop=stop,
-            )
 
-            usage_dict = {}
-            react_chunks = CotAgentOutputParser.handle_react_stream_output(
-                chunks, usage_dict
-            )
-            scratchpad = AgentScratchpadUnit(
-                agent_response="",
-                thought="",
-                action_str="",
-                observation="",
-                action=None,
-            )
+                usage_dict = {}
+                react_chunks = CotAgentOutputParser.handle_react_stream_output(
+                    chunks, usage_dict
+                )
+                scratchpad = AgentScratchpadUnit(
+                    agent_response="",
+                    thought="",
+                    action_str="",
+                    observation="",
+                    action=None,
+                )
 
-            model_started_at = time.perf_counter()
-            model_log = self.create_log_message(
-                label=f"{model.model} Thought",
-                data={},
-                metadata={
-                    LogMetadata.STARTED_AT: model_started_at,
-                    LogMetadata.PROVIDER: model.provider,
-                },
-                parent=round_log,
-                status=ToolInvokeMessage.LogMessage.LogStatus.START,
-            )
-            yield model_log
+                model_started_at = time.perf_counter()
+                model_log = self.create_log_message(
+                    label=f"{model.model} Thought",
+                    data={},
+                    metadata={
+                        LogMetadata.STARTED_AT: model_started_at,
+                        LogMetadata.PROVIDER: model.provider,
+                    },
+                    parent=round_log,
+                    status=ToolInvokeMessage.LogMessage.LogStatus.START,
+                )
+                yield model_log
 
-            for chunk in react_chunks:
-                if isinstance(chunk, AgentScratchpadUnit.Action):
-                    action = chunk
-                    # detect action
-                    assert scratchpad.agent_response is not None
-                    scratchpad.agent_response += json.dumps(chunk.model_dump())
+                for chunk in react_chunks:
+                    if isinstance(chunk, AgentScratchpadUnit.Action):
+                        action = chunk
+                        # detect action
+                        assert scratchpad.agent_response is not None
+                        scratchpad.agent_response += json.dumps(chunk.model_dump())
 
-                    scratchpad.action_str = json.dumps(chunk.model_dump())
-                    scratchpad.action = action
-                else:
-                    scratchpad.agent_response = scratchpad.agent_response or ""
-                    scratchpad.thought = scratchpad.thought or ""
-                    scratchpad.agent_response += chunk
-                    scratchpad.thought += chunk
-            scratchpad.thought = (
-                scratchpad.thought.strip()
-                if scratchpad.thought
-                else "I am thinking about how to help you"
-            )
-            agent_scratchpad.append(scratchpad)
+                        scratchpad.action_str = json.dumps(chunk.model_dump())
+                        scratchpad.action = action
+                    else:
+                        scratchpad.agent_response = scratchpad.agent_response or ""
+                        scratchpad.thought = scratchpad.thought or ""
+                        scratchpad.agent_response += chunk
+                        scratchpad.thought += chunk
+                scratchpad.thought = (
+                    scratchpad.thought.strip()
+                    if scratchpad.thought
+                    else "I am thinking about how to help you"
+                )
+                agent_scratchpad.append(scratchpad)
 
-            # get llm usage
-            if "usage" in usage_dict:
-                if usage_dict["usage"] is not None:
-                    self.increase_usage(llm_usage, usage_dict["usage"])
-            else:
-                usage_dict["usage"] = LLMUsage.empty_usage()
+                # get llm usage
+                if "usage" in usage_dict:
+                    if usage_dict["usage"] is not None:
+                        self.increase_usage(llm_usage, usage_dict["usage"])
+                else:
+                    usage_dict["usage"] = LLMUsage.empty_usage()
 
-            action = (
-                scratchpad.action.to_dict()
-                if scratchpad.action
-                else {"action": scratchpad.agent_response}
-            )
+                action = (
+                    scratchpad.action.to_dict()
+                    if scratchpad.action
+                    else {"action": scratchpad.agent_response}
+                )
 
-            yield self.finish_log_message(
-                log=model_log,
-                data={"thought": scratchpad.thought, **action},
-                metadata={
-                    LogMetadata.STARTED_AT: model_started_at,
-                    LogMetadata.FINISHED_AT: time.perf_counter(),
-                    LogMetadata.ELAPSED_TIME: time.perf_counter() - model_started_at,
-                    LogMetadata.PROVIDER: model.provider,
-                    LogMetadata.TOTAL_PRICE: usage_dict["usage"].total_price
-                    if usage_dict["usage"]
-                    else 0,
-                    LogMetadata.CURRENCY: usage_dict["usage"].currency
-                    if usage_dict["usage"]
-                    else "",
-                    LogMetadata.TOTAL_TOKENS: usage_dict["usage"].total_tokens
-                    if usage_dict["usage"]
-                    else 0,
-                },
-            )
-            if not scratchpad.action:
-                final_answer = scratchpad.thought
-            else:
-                if scratchpad.action.action_name.lower() == "final answer":
-                    # action is final answer, return final answer directly
-                    try:
-                        if isinstance(scratchpad.action.action_input, dict):
-                            final_answer = json.dumps(scratchpad.action.action_input)
-                        elif isinstance(scratchpad.action.action_input, str):
-                            final_answer = scratchpad.action.action_input
-                        else:
-                            final_answer = f"{scratchpad.action.action_input}"
-                    except json.JSONDecodeError:
-                        final_answer = f"{scratchpad.action.action_input}"
+                yield self.finish_log_message(
+                    log=model_log,
+                    data={"thought": scratchpad.thought, **action},
+                    metadata={
+                        LogMetadata.STARTED_AT: model_started_at,
+                        LogMetadata.FINISHED_AT: time.perf_counter(),
+                        LogMetadata.ELAPSED_TIME: time.perf_counter() - model_started_at,
+                        LogMetadata.PROVIDER: model.provider,
+                        LogMetadata.TOTAL_PRICE: usage_dict["usage"].total_price
+                        if usage_dict["usage"]
+                        else 0,
+                        LogMetadata.CURRENCY: usage_dict["usage"].currency
+                        if usage_dict["usage"]
+                        else "",
+                        LogMetadata.TOTAL_TOKENS: usage_dict["usage"].total_tokens
+                        if usage_dict["usage"]
+                        else 0,
+                    },
+                )
+                if not scratchpad.action:
+                    final_answer = scratchpad.thought
                 else:
-                    run_agent_state = True
-                    # action is tool call, invoke tool
-                    tool_call_started_at = time.perf_counter()
-                    tool_name = scratchpad.action.action_name
-                    tool_call_log = self.create_log_message(
-                        label=f"CALL {tool_name}",
-                        data={},
-                        metadata={
-                            LogMetadata.STARTED_AT: time.perf_counter(),
-                            LogMetadata.PROVIDER: tool_instances[
-                                tool_name
-                            ].identity.provider
-                            if tool_instances.get(tool_name)
-                            else "",
-                        },
-                        parent=round_log,
-                        status=ToolInvokeMessage.LogMessage.LogStatus.START,
-                    )
-                    yield tool_call_log
-                    tool_invoke_response, tool_invoke_parameters = (
-                        self._handle_invoke_action(
-                            action=scratchpad.action,
-                            tool_instances=tool_instances,
-                            mcp_clients=mcp_clients,
-                            mcp_tool_instances=mcp_tool_instances,
-                            message_file_ids=message_file_ids,
+                    if scratchpad.action.action_name.lower() == "final answer":
+                        # action is final answer, return final answer directly
+                        try:
+                            if isinstance(scratchpad.action.action_input, dict):
+                                final_answer = json.dumps(scratchpad.action.action_input)
+                            elif isinstance(scratchpad.action.action_input, str):
+                                final_answer = scratchpad.action.action_input
+                            else:
+                                final_answer = f"{scratchpad.action.action_input}"
+                        except json.JSONDecodeError:
+                            final_answer = f"{scratchpad.action.action_input}"
+                    else:
+                        run_agent_state = True
+                        # action is tool call, invoke tool
+                        tool_call_started_at = time.perf_counter()
+                        tool_name = scratchpad.action.action_name
+                        tool_call_log = self.create_log_message(
+                            label=f"CALL {tool_name}",
+                            data={},
+                            metadata={
+                                LogMetadata.STARTED_AT: time.perf_counter(),
+                                LogMetadata.PROVIDER: tool_instances[
+                                    tool_name
+                                ].identity.provider
+                                if tool_instances.get(tool_name)
+                                else "",
+                            },
+                            parent=round_log,
+                            status=ToolInvokeMessage.LogMessage.LogStatus.START,
                         )
-                    )
-                    scratchpad.observation = tool_invoke_response
-                    scratchpad.agent_response = tool_invoke_response
-                    yield self.finish_log_message(
-                        log=tool_call_log,
-                        data={
-                            "tool_name": tool_name,
-                            "tool_call_args": tool_invoke_parameters,
-                            "output": tool_invoke_response,
-                        },
-                        metadata={
-                            LogMetadata.STARTED_AT: tool_call_started_at,
-                            LogMetadata.PROVIDER: tool_instances[
-                                tool_name
-                            ].identity.provider
-                            if tool_instances.get(tool_name)
-                            else "",
-                            LogMetadata.FINISHED_AT: time.perf_counter(),
-                            LogMetadata.ELAPSED_TIME: time.perf_counter()
-                                                      - tool_call_started_at,
-                        },
-                    )
-
-                # update prompt tool message
-                for prompt_tool in self._prompt_messages_tools:
-                    if prompt_tool.name in tool_instances:
-                        self.update_prompt_message_tool(
-                            tool_instances[prompt_tool.name], prompt_tool
+                        yield tool_call_log
+                        tool_invoke_response, tool_invoke_parameters = (
+                            self._handle_invoke_action(
+                                action=scratchpad.action,
+                                tool_instances=tool_instances,
+                                mcp_clients=mcp_clients,
+                                mcp_tool_instances=mcp_tool_instances,
+                                message_file_ids=message_file_ids,
+                            )
                         )
-            yield self.finish_log_message(
-                log=round_log,
-                data={
-                    "action_name": scratchpad.action.action_name
-                    if scratchpad.action
-                    else "",
-                    "action_input": scratchpad.action.action_input
-                    if scratchpad.action
-                    else "",
-                    "thought": scratchpad.thought,
-                    "observation": scratchpad.observation,
-                },
-                metadata={
-                    LogMetadata.STARTED_AT: round_started_at,
-                    LogMetadata.FINISHED_AT: time.perf_counter(),
-                    LogMetadata.ELAPSED_TIME: time.perf_counter() - round_started_at,
-                    LogMetadata.TOTAL_PRICE: usage_dict["usage"].total_price
-                    if usage_dict["usage"]
-                    else 0,
-                    LogMetadata.CURRENCY: usage_dict["usage"].currency
-                    if usage_dict["usage"]
-                    else "",
-                    LogMetadata.TOTAL_TOKENS: usage_dict["usage"].total_tokens
-                    if usage_dict["usage"]
-                    else 0,
-                },
-            )
-            iteration_step += 1
-
-        # All MCP Client close
-        if mcp_clients:
-            mcp_clients.close()
-
-        yield self.create_text_message(final_answer)
-        yield self.create_json_message(
-            {
-                "execution_metadata": {
-                    LogMetadata.TOTAL_PRICE: llm_usage["usage"].total_price
-                    if llm_usage["usage"] is not None
-                    else 0,
-                    LogMetadata.CURRENCY: llm_usage["usage"].currency
-                    if llm_usage["usage"] is not None
-                    else "",
-                    LogMetadata.TOTAL_TOKENS: llm_usage["usage"].total_tokens
-                    if llm_usage["usage"] is not None
-                    else 0,
+                        scratchpad.observation = tool_invoke_response
+                        scratchpad.agent_response = tool_invoke_response
+                        yield self.finish_log_message(
+                            log=tool_call_log,
+                            data={
+                                "tool_name": tool_name,
+                                "tool_call_args": tool_invoke_parameters,
+                                "output": tool_invoke_response,
+                            },
+                            metadata={
+                                LogMetadata.STARTED_AT: tool_call_started_at,
+                                LogMetadata.PROVIDER: tool_instances[
+                                    tool_name
+                                ].identity.provider
+                                if tool_instances.get(tool_name)
+                                else "",
+                                LogMetadata.FINISHED_AT: time.perf_counter(),
+                                LogMetadata.ELAPSED_TIME: time.perf_counter()
+                                                          - tool_call_started_at,
+                            },
+                        )
+
+                        # update prompt tool message, only the called tool can have changed
+                        prompt_tool = prompt_tools_by_name.get(tool_name)
+                        if prompt_tool:
+                            self.update_prompt_message_tool(tool_instances[tool_name], prompt_tool)
+                            self._prompt_tools_json = None
+                yield self.finish_log_message(
+                    log=round_log,
+                    data={
+                        "action_name": scratchpad.action.action_name
+                        if scratchpad.action
+                        else "",
+                        "action_input": scratchpad.action.action_input
+                        if scratchpad.action
+                        else "",
+                        "thought": scratchpad.thought,
+                        "observation": scratchpad.observation,
+                    },
+                    metadata={
+                        LogMetadata.STARTED_AT: round_started_at,
+                        LogMetadata.FINISHED_AT: time.perf_counter(),
+                        LogMetadata.ELAPSED_TIME: time.perf_counter() - round_started_at,
+                        LogMetadata.TOTAL_PRICE: usage_dict["usage"].total_price
+                        if usage_dict["usage"]
+                        else 0,
+                        LogMetadata.CURRENCY: usage_dict["usage"].currency
+                        if usage_dict["usage"]
+                        else "",
+                        LogMetadata.TOTAL_TOKENS: usage_dict["usage"].total_tokens
+                        if usage_dict["usage"]
+                        else 0,
+                    },
+                )
+                iteration_step += 1
+
+            yield self.create_text_message(final_answer)
+            yield self.create_json_message(
+                {
+                    "execution_metadata": {
+                        LogMetadata.TOTAL_PRICE: llm_usage["usage"].total_price
+                        if llm_usage["usage"] is not None
+                        else 0,
+                        LogMetadata.CURRENCY: llm_usage["usage"].currency
+                        if llm_usage["usage"] is not None
+                        else "",
+                        LogMetadata.TOTAL_TOKENS: llm_usage["usage"].total_tokens
+                        if llm_usage["usage"] is not None
+                        else 0,
+                    }
                 }
-            }
-        )
+            )
+        finally:
+            # the stdio servers are child processes, close the clients however the run ends
+            if mcp_clients:
+                mcp_clients.close()
 
     def _organize_user_query(
             self, query, prompt_messages: list[PromptMessage]
@@ -487,11 +501,15 @@ class ReActAgentStrategy(AgentStrategy):
             try:
                 tool_call_args = json.loads(tool_call_args)
             except json.JSONDecodeError as e:
-                params = [
-                    param.name
-                    for param in tool_instance.parameters
-                    if param.form == ToolParameter.ToolParameterForm.LLM
-                ]
+                if mcp_tool_instance:
+                    # MCP tools have no Dify tool instance, take the parameters from the input schema
+                    params = list((mcp_tool_instance.get("inputSchema") or {}).get("properties") or {})
+                else:
+                    params = [
+                        param.name
+                        for param in tool_instance.parameters
+                        if param.form == ToolParameter.ToolParameterForm.LLM
+                    ]
                 if len(params) > 1:
                     raise ValueError("tool call args is not a valid json string") from e
                 tool_call_args = {params[0]: tool_call_args} if len(params) == 1 else {}
@@ -581,10 +599,15 @@ class ReActAgentStrategy(AgentStrategy):
         prompt_messages_tools = []
 
         for tool in mcp_tools:
+            # description is optional and inputSchema may be missing or null, neither passes validation as is
+            # the descriptors come straight from the server's tools/list, validate them for a clear error on bad data
+            input_schema = tool.get("inputSchema") or {}
+            if isinstance(input_schema, dict):
+                input_schema = {"properties": {}, "required": [], **input_schema}
             prompt_message = PromptMessageTool(
                 name=tool.get("name"),
-                description=tool.get("description", ""),
-                parameters=tool.get("inputSchema"),
+                description=tool.get("description") or "",
+                parameters=input_schema,
             )
             prompt_messages_tools.append(prompt_message)
 
@@ -1,10 +1,11 @@
 import json
 import time
-import subprocess
-from collections.abc import Generator
-from copy import deepcopy
+from collections.abc import Generator, Iterator, Mapping
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from decimal import Decimal
 from typing import Any, Optional, cast
 
+import orjson
 import pydantic
 from dify_plugin.entities.agent import AgentInvokeMessage
 from dify_plugin.entities.model import ModelFeature
@@ -44,6 +45,7 @@ class FunctionCallingAgentStrategy(AgentStrategy):
         super().__init__(session)
         self.query = ""
         self.instruction = ""
+        self._prompt_tokens_cache: dict[str, int] = {}
 
     @property
     def _user_prompt_message(self) -> UserPromptMessage:
@@ -63,22 +65,11 @@ class FunctionCallingAgentStrategy(AgentStrategy):
         except pydantic.ValidationError as e:
             raise ValueError(f"Invalid parameters: {e!s}") from e
 
-        # init prompt messages
-        query = fc_params.query
-        self.query = query
-        self.instruction = fc_params.instruction
-        history_prompt_messages = fc_params.model.history_prompt_messages
-        history_prompt_messages.insert(0, self._system_prompt_message)
-        history_prompt_messages.append(self._user_prompt_message)
-
-        # convert tool messages
-        tools = fc_params.tools
-        tool_instances = {tool.identity.name: tool for tool in tools} if tools else {}
-
-        # Fetch MCP tools
+        # Fetch MCP tools in the background while the rest of the run is prepared
         mcp_clients = None
         mcp_tools = []
         mcp_tool_instances = {}
+        mcp_future = None
         servers_config_json = fc_params.mcp_servers_config
         if servers_config_json:
             try:
@@ -87,341 +78,456 @@ class FunctionCallingAgentStrategy(AgentStrategy):
                 servers_config = config.get("mcpServers", config)
             except json.JSONDecodeError as e:
                 raise ValueError(f"mcp_servers_config must be a valid JSON string: {e}")
-            mcp_clients = McpClients(servers_config)
-            mcp_tools = mcp_clients.fetch_tools()
-            mcp_tool_instances = {tool.get("name"): tool for tool in mcp_tools} if mcp_tools else {}
-
-        # convert tools into ModelRuntime Tool format
-        prompt_messages_tools = self._init_prompt_tools(tools)
-        prompt_messages_tools.extend(self._init_prompt_mcp_tools(mcp_tools))
-
-        # init model parameters
-        stream = (
-            ModelFeature.STREAM_TOOL_CALL in fc_params.model.entity.features
-            if fc_params.model.entity and fc_params.model.entity.features
-            else False
-        )
-        model = fc_params.model
-        stop = fc_params.model.completion_params.get("stop", []) if fc_params.model.completion_params else []
-
-        # init function calling state
-        iteration_step = 1
-        max_iteration_steps = fc_params.maximum_iterations
-        current_thoughts: list[PromptMessage] = []
-        function_call_state = True  # continue to run until there is not any tool call
-        llm_usage: dict[str, Optional[LLMUsage]] = {"usage": None}
-        final_answer = ""
-
-        while function_call_state and iteration_step <= max_iteration_steps:
-            # start a new round
-            function_call_state = False
-            round_started_at = time.perf_counter()
-            round_log = self.create_log_message(
-                label=f"ROUND {iteration_step}",
-                data={},
-                metadata={
-                    LogMetadata.STARTED_AT: round_started_at,
-                },
-                status=ToolInvokeMessage.LogMessage.LogStatus.START,
-            )
-            yield round_log
+            # a worker of its own, so other runs' tool calls never delay this run's setup
+            mcp_executor = ThreadPoolExecutor(max_workers=1)
+            mcp_future = mcp_executor.submit(self._fetch_mcp_tools, servers_config)
+            mcp_executor.shutdown(wait=False)
 
-            # If max_iteration_steps=1, need to execute tool calls
-            if iteration_step == max_iteration_steps and max_iteration_steps > 1:
-                # the last iteration, remove all tools
-                prompt_messages_tools = []
-
-            # recalc llm max tokens
-            prompt_messages = self._organize_prompt_messages(
-                history_prompt_messages=history_prompt_messages,
-                current_thoughts=current_thoughts,
-            )
-            if model.entity and model.completion_params:
-                self.recalc_llm_max_tokens(model.entity, prompt_messages, model.completion_params)
-            # invoke model
-            model_started_at = time.perf_counter()
-            model_log = self.create_log_message(
-                label=f"{model.model} Thought",
-                data={},
-                metadata={
-                    LogMetadata.STARTED_AT: model_started_at,
-                    LogMetadata.PROVIDER: model.provider,
-                },
-                parent=round_log,
-                status=ToolInvokeMessage.LogMessage.LogStatus.START,
+        try:
+            # init prompt messages
+            query = fc_params.query
+            self.query = query
+            self.instruction = fc_params.instruction
+            history_prompt_messages = fc_params.model.history_prompt_messages
+            history_prompt_messages.insert(0, self._system_prompt_message)
+            history_prompt_messages.append(self._user_prompt_message)
+
+            # convert tool messages
+            tools = fc_params.tools
+            tool_instances = {tool.identity.name: tool for tool in tools} if tools else {}
+            tool_providers = {name: tool.identity.provider for name, tool in tool_instances.items()}
+
+            # convert tools into ModelRuntime Tool format
+            prompt_messages_tools = self._init_prompt_tools(tools)
+
+            # init model parameters
+            stream = (
+                ModelFeature.STREAM_TOOL_CALL in fc_params.model.entity.features
+                if fc_params.model.entity and fc_params.model.entity.features
+                else False
             )
-            yield model_log
+            model = fc_params.model
+            stop = fc_params.model.completion_params.get("stop", []) if fc_params.model.completion_params else []
+            # the model config does not change between rounds, only its max tokens are recalculated
             model_config = LLMModelConfig(**model.model_dump(mode="json"))
-            chunks: Generator[LLMResultChunk, None, None] | LLMResult = self.session.model.llm.invoke(
-                model_config=model_config,
-                prompt_messages=prompt_messages,
-                stop=stop,
-                stream=stream,
-                tools=prompt_messages_tools,
-            )
-
-            tool_calls: list[tuple[str, str, dict[str, Any]]] = []
-
-            # save full response
-            response = ""
-
-            # save tool call names and inputs
-            tool_call_names = ""
-
-            current_llm_usage = None
-
-            if isinstance(chunks, Generator):
-                for chunk in chunks:
-                    # check if there is any tool call
-                    if self.check_tool_calls(chunk):
-                        function_call_state = True
-                        tool_calls.extend(self.extract_tool_calls(chunk) or [])
-                        tool_call_names = ";".join([tool_call[1] for tool_call in tool_calls])
-
-                    if chunk.delta.message and chunk.delta.message.content:
-                        if isinstance(chunk.delta.message.content, list):
-                            for content in chunk.delta.message.content:
-                                response += content.data
-                                if not function_call_state or iteration_step == max_iteration_steps:
-                                    yield self.create_text_message(content.data)
-                        else:
-                            response += str(chunk.delta.message.content)
-                            if not function_call_state or iteration_step == max_iteration_steps:
-                                yield self.create_text_message(str(chunk.delta.message.content))
-
-                    if chunk.delta.usage:
-                        self.increase_usage(llm_usage, chunk.delta.usage)
-                        current_llm_usage = chunk.delta.usage
 
-            else:
-                result = chunks
-                result = cast(LLMResult, result)
-                # check if there is any tool call
-                if self.check_blocking_tool_calls(result):
-                    function_call_state = True
-                    tool_calls.extend(self.extract_blocking_tool_calls(result) or [])
-                    tool_call_names = ";".join([tool_call[1] for tool_call in tool_calls])
-
-                if result.usage:
-                    self.increase_usage(llm_usage, result.usage)
-                    current_llm_usage = result.usage
-
-                if result.message and result.message.content:
-                    if isinstance(result.message.content, list):
-                        for content in result.message.content:
-                            response += content.data
-                    else:
-                        response += str(result.message.content)
-
-                if not result.message.content:
-                    result.message.content = ""
-                if isinstance(result.message.content, str):
-                    yield self.create_text_message(result.message.content)
-                elif isinstance(result.message.content, list):
-                    for content in result.message.content:
-                        yield self.create_text_message(content.data)
-
-            yield self.finish_log_message(
-                log=model_log,
-                data={
-                    "output": response,
-                    "tool_name": tool_call_names,
-                    "tool_input": {tool_call[1]: tool_call[2] for tool_call in tool_calls},
-                },
-                metadata={
-                    LogMetadata.STARTED_AT: model_started_at,
-                    LogMetadata.FINISHED_AT: time.perf_counter(),
-                    LogMetadata.ELAPSED_TIME: time.perf_counter() - model_started_at,
-                    LogMetadata.PROVIDER: model.provider,
-                    LogMetadata.TOTAL_PRICE: current_llm_usage.total_price if current_llm_usage else 0,
-                    LogMetadata.CURRENCY: current_llm_usage.currency if current_llm_usage else "",
-                    LogMetadata.TOTAL_TOKENS: current_llm_usage.total_tokens if current_llm_usage else 0,
-                },
-            )
-            assistant_message = AssistantPromptMessage(content="", tool_calls=[])
-            if tool_calls:
-                assistant_message.tool_calls = [
-                    AssistantPromptMessage.ToolCall(
-                        id=tool_call[0],
-                        type="function",
-                        function=AssistantPromptMessage.ToolCall.ToolCallFunction(
-                            name=tool_call[1],
-                            arguments=json.dumps(tool_call[2], ensure_ascii=False),
-                        ),
-                    )
-                    for tool_call in tool_calls
-                ]
-            else:
-                assistant_message.content = response
+            # wait for the MCP tools
+            if mcp_future:
+                mcp_clients, mcp_tools = mcp_future.result()
+                mcp_tool_instances = {tool.get("name"): tool for tool in mcp_tools} if mcp_tools else {}
+            prompt_messages_tools.extend(self._init_prompt_mcp_tools(mcp_tools))
+            prompt_tools_by_name = {
+                prompt_tool.name: prompt_tool for prompt_tool in prompt_messages_tools if prompt_tool.name in tool_instances
+            }
+            # one lookup per tool call, MCP tools take precedence over Dify tools with the same name
+            tool_lookup: dict[str, tuple[str, Any]] = {
+                **{name: ("tool", tool) for name, tool in tool_instances.items()},
+                **{name: ("mcp", tool) for name, tool in mcp_tool_instances.items()},
+            }
 
-            current_thoughts.append(assistant_message)
+            # init function calling state
+            iteration_step = 1
+            max_iteration_steps = fc_params.maximum_iterations
+            current_thoughts: list[PromptMessage] = []
+            function_call_state = True  # continue to run until there is not any tool call
+            llm_usage: Optional[LLMUsage] = None
+
+            while function_call_state and iteration_step <= max_iteration_steps:
+                # start a new round
+                function_call_state = False
+                round_started_at = time.perf_counter()
+                round_log = self.create_log_message(
+                    label=f"ROUND {iteration_step}",
+                    data={},
+                    metadata={
+                        LogMetadata.STARTED_AT: round_started_at,
+                    },
+                    status=ToolInvokeMessage.LogMessage.LogStatus.START,
+                )
+                yield round_log
 
-            final_answer += response + "\n"
+                # If max_iteration_steps=1, need to execute tool calls
+                if iteration_step == max_iteration_steps and max_iteration_steps > 1:
+                    # the last iteration, remove all tools
+                    prompt_messages_tools = []
 
-            # call tools
-            tool_responses = []
-            for tool_call_id, tool_call_name, tool_call_args in tool_calls:
-                tool_instance = tool_instances.get(tool_call_name)
-                tool_provider = tool_instance.identity.provider if tool_instance else ""
-                 = s.get(tool_call_name)
-                tool_call_started_at = time.perf_counter()
-                tool_call_log = self.create_log_message(
-                    label=f"CALL {tool_call_name}",
+                # recalc llm max tokens
+                prompt_messages = self._organize_prompt_messages(
+                    history_prompt_messages=history_prompt_messages,
+                    current_thoughts=current_thoughts,
+                )
+                if model.entity and model_config.completion_params:
+                    self.recalc_llm_max_tokens(model.entity, prompt_messages, model_config.completion_params)
+                # invoke model
+                model_started_at = time.perf_counter()
+                model_log = self.create_log_message(
+                    label=f"{model.model} Thought",
                     data={},
                     metadata={
-                        LogMetadata.STARTED_AT: time.perf_counter(),
-                        LogMetadata.PROVIDER: tool_provider,
+                        LogMetadata.STARTED_AT: model_started_at,
+                        LogMetadata.PROVIDER: model.provider,
                     },
                     parent=round_log,
                     status=ToolInvokeMessage.LogMessage.LogStatus.START,
                 )
-                yield tool_call_log
-                if not tool_instance and not :
-                    tool_response = {
-                        "tool_call_id": tool_call_id,
-                        "tool_call_name": tool_call_name,
-                        "tool_response": f"there is not a tool named {tool_call_name}",
-                        "meta": ToolInvokeMeta.error_instance(f"there is not a tool named {tool_call_name}").to_dict(),
-                    }
-                else:
+                yield model_log
+                chunks: Generator[LLMResultChunk, None, None] | LLMResult = self.session.model.llm.invoke(
+                    model_config=model_config,
+                    prompt_messages=prompt_messages,
+                    stop=stop,
+                    stream=stream,
+                    tools=prompt_messages_tools,
+                )
 
-                    tool_invoke_parameters = {}
-                    try:
-                        if mcp_tool_instance:
-                            # invoke MCP tool
-                            tool_invoke_parameters = tool_call_args
-                            # 检查是否是本地命令执行
-                            server_config = servers_config.get(tool_call_name)
-                            if server_config and "command" in server_config:
-                                # 执行本地命令
-                                command = server_config["command"]
-                                args = server_config.get("args", [])
-                                
-                                # 构建完整命令
-                                cmd_list = [command] + args
-                                
-                                # 执行命令并获取输出
-                                try:
-                                    process = subprocess.run(
-                                        cmd_list,
-                                        stdout=subprocess.PIPE,
-                                        stderr=subprocess.PIPE,
-                                        text=True,
-                                        check=True
-                                    )
-                                    result = process.stdout
-                                except subprocess.CalledProcessError as e:
-                                    result = f"Command execution failed: {e}\nStderr: {e.stderr}"
-                                except Exception as e:
-                                    result = f"Failed to execute command: {e}"
+                tool_calls: list[tuple[str, str, dict[str, Any], str]] = []
+
+                # save full response
+                response_parts: list[str] = []
+
+                current_llm_usage = None
+
+                if isinstance(chunks, Generator):
+                    # runs once per streamed delta, keep lookups in locals
+                    check_tool_calls = self.check_tool_calls
+                    extract_tool_calls = self.extract_tool_calls
+                    create_text_message = self.create_text_message
+                    is_last_iteration = iteration_step == max_iteration_steps
+                    # sum the streamed usage in locals and add it to llm_usage once per stream
+                    prompt_tokens = completion_tokens = total_tokens = 0
+                    prompt_price = completion_price = total_price = Decimal(0)
+                    for chunk in chunks:
+                        delta = chunk.delta
+                        # check if there is any tool call
+                        if check_tool_calls(chunk):
+                            function_call_state = True
+                            tool_calls.extend(extract_tool_calls(chunk))
+
+                        message_content = delta.message.content if delta.message else None
+                        if message_content:
+                            if isinstance(message_content, list):
+                                for content in message_content:
+                                    response_parts.append(content.data)
+                                    if not function_call_state or is_last_iteration:
+                                        yield create_text_message(content.data)
                             else:
-                                # 常规 MCP 工具执行
-                                result = mcp_clients.execute_tool(
-                                    tool_name=tool_call_name,
-                                    tool_args=tool_invoke_parameters,
-                                )
+                                message_content = str(message_content)
+                                response_parts.append(message_content)
+                                if not function_call_state or is_last_iteration:
+                                    yield create_text_message(message_content)
+
+                        usage = delta.usage
+                        if usage:
+                            prompt_tokens += usage.prompt_tokens
+                            completion_tokens += usage.completion_tokens
+                            total_tokens += usage.total_tokens
+                            prompt_price += usage.prompt_price
+                            completion_price += usage.completion_price
+                            total_price += usage.total_price
+                            current_llm_usage = usage
+
+                    if current_llm_usage:
+                        llm_usage = self._increase_usage(
+                            llm_usage,
+                            current_llm_usage.model_copy(
+                                update={
+                                    "prompt_tokens": prompt_tokens,
+                                    "completion_tokens": completion_tokens,
+                                    "total_tokens": total_tokens,
+                                    "prompt_price": prompt_price,
+                                    "completion_price": completion_price,
+                                    "total_price": total_price,
+                                }
+                            ),
+                        )
+
+                else:
+                    result = chunks
+                    result = cast(LLMResult, result)
+                    # check if there is any tool call
+                    if self.check_blocking_tool_calls(result):
+                        function_call_state = True
+                        tool_calls.extend(self.extract_blocking_tool_calls(result))
+
+                    if result.usage:
+                        llm_usage = self._increase_usage(llm_usage, result.usage)
+                        current_llm_usage = result.usage
+
+                    if result.message and result.message.content:
+                        if isinstance(result.message.content, list):
+                            for content in result.message.content:
+                                response_parts.append(content.data)
                         else:
-                            # invoke tool
-                            tool_invoke_parameters = {**tool_instance.runtime_parameters, **tool_call_args}
-                            tool_invoke_responses = self.session.tool.invoke(
-                                provider_type=ToolProviderType(tool_instance.provider_type),
-                                provider=tool_instance.identity.provider,
-                                tool_name=tool_instance.identity.name,
-                                parameters=tool_invoke_parameters,
-                            )
-                            result = ""
-                            for response in tool_invoke_responses:
-                                if response.type == ToolInvokeMessage.MessageType.TEXT:
-                                    result += cast(ToolInvokeMessage.TextMessage, response.message).text
-                                elif response.type == ToolInvokeMessage.MessageType.LINK:
-                                    result += (
-                                            f"result link: {cast(ToolInvokeMessage.TextMessage, response.message).text}."
-                                            + " please tell user to check it."
-                                    )
-                                elif response.type in {
-                                    ToolInvokeMessage.MessageType.IMAGE_LINK,
-                                    ToolInvokeMessage.MessageType.IMAGE,
-                                }:
-                                    result += (
-                                            "image has been created and sent to user already, "
-                                            + "you do not need to create it, just tell the user to check it now."
-                                    )
-                                elif response.type == ToolInvokeMessage.MessageType.JSON:
-                                    text = json.dumps(
-                                        cast(ToolInvokeMessage.JsonMessage, response.message).json_object,
-                                        ensure_ascii=False,
-                                    )
-                                    result += f"tool response: {text}."
-                                else:
-                                    result += f"tool response: {response.message!r}."
-                    except Exception as e:
-                        result = f"tool invoke error: {e!s}"
-                    tool_response = {
-                        "tool_call_id": tool_call_id,
-                        "tool_call_name": tool_call_name,
-                        "tool_call_input": tool_invoke_parameters,
-                        "tool_response": result,
-                    }
+                            response_parts.append(str(result.message.content))
+
+                    if not result.message.content:
+                        result.message.content = ""
+                    if isinstance(result.message.content, str):
+                        yield self.create_text_message(result.message.content)
+                    elif isinstance(result.message.content, list):
+                        for content in result.message.content:
+                            yield self.create_text_message(content.data)
 
+                response = "".join(response_parts)
+
+                # save tool call names and inputs
+                tool_call_names = ";".join(tool_call[1] for tool_call in tool_calls)
+                tool_call_inputs = {tool_call[1]: tool_call[2] for tool_call in tool_calls}
+                model_finished_at = time.perf_counter()
                 yield self.finish_log_message(
-                    log=tool_call_log,
+                    log=model_log,
                     data={
-                        "output": tool_response,
+                        "output": response,
+                        "tool_name": tool_call_names,
+                        "tool_input": tool_call_inputs,
                     },
                     metadata={
-                        LogMetadata.STARTED_AT: tool_call_started_at,
-                        LogMetadata.PROVIDER: tool_provider,
-                        LogMetadata.FINISHED_AT: time.perf_counter(),
-                        LogMetadata.ELAPSED_TIME: time.perf_counter() - tool_call_started_at,
+                        LogMetadata.STARTED_AT: model_started_at,
+                        LogMetadata.FINISHED_AT: model_finished_at,
+                        LogMetadata.ELAPSED_TIME: model_finished_at - model_started_at,
+                        LogMetadata.PROVIDER: model.provider,
+                        LogMetadata.TOTAL_PRICE: current_llm_usage.total_price if current_llm_usage else 0,
+                        LogMetadata.CURRENCY: current_llm_usage.currency if current_llm_usage else "",
+                        LogMetadata.TOTAL_TOKENS: current_llm_usage.total_tokens if current_llm_usage else 0,
                     },
                 )
-                tool_responses.append(tool_response)
-                if tool_response["tool_response"] is not None:
-                    current_thoughts.append(
-                        ToolPromptMessage(
-                            content=str(tool_response["tool_response"]),
-                            tool_call_id=tool_call_id,
-                            name=tool_call_name,
+                # messages built from already parsed model output, skip pydantic validation
+                assistant_message = AssistantPromptMessage.model_construct(content="", tool_calls=[])
+                if tool_calls:
+                    assistant_message.tool_calls = [
+                        AssistantPromptMessage.ToolCall.model_construct(
+                            id=tool_call[0],
+                            type="function",
+                            function=AssistantPromptMessage.ToolCall.ToolCallFunction.model_construct(
+                                name=tool_call[1],
+                                # the model's own arguments are valid JSON already, no need to encode them again
+                                arguments=tool_call[3] or "{}",
+                            ),
                         )
+                        for tool_call in tool_calls
+                    ]
+                else:
+                    assistant_message.content = response
+
+                current_thoughts.append(assistant_message)
+
+                # call tools
+                tool_call_logs = []
+                for tool_call_id, tool_call_name, _, _ in tool_calls:
+                    tool_provider = tool_providers.get(tool_call_name, "")
+                    tool_call_started_at = time.perf_counter()
+                    tool_call_log = self.create_log_message(
+                        label=f"CALL {tool_call_name}",
+                        data={},
+                        metadata={
+                            LogMetadata.STARTED_AT: tool_call_started_at,
+                            LogMetadata.PROVIDER: tool_provider,
+                        },
+                        parent=round_log,
+                        status=ToolInvokeMessage.LogMessage.LogStatus.START,
                     )
+                    yield tool_call_log
+                    tool_call_logs.append((tool_call_log, tool_provider, tool_call_started_at))
+
+                # tool calls of one round are independent, run them concurrently
+                tool_responses = [None] * len(tool_calls)
+                if tool_calls:
+                    with ThreadPoolExecutor(max_workers=len(tool_calls)) as executor:
+                        futures = {
+                            executor.submit(
+                                self._invoke_tool_call,
+                                tool_call=tool_call,
+                                tool_lookup=tool_lookup,
+                                mcp_clients=mcp_clients,
+                            ): index
+                            for index, tool_call in enumerate(tool_calls)
+                        }
+                        for future in as_completed(futures):
+                            index = futures[future]
+                            tool_response = future.result()
+                            tool_call_log, tool_provider, tool_call_started_at = tool_call_logs[index]
+                            tool_call_finished_at = time.perf_counter()
+                            yield self.finish_log_message(
+                                log=tool_call_log,
+                                data={
+                                    "output": tool_response,
+                                },
+                                metadata={
+                                    LogMetadata.STARTED_AT: tool_call_started_at,
+                                    LogMetadata.PROVIDER: tool_provider,
+                                    LogMetadata.FINISHED_AT: tool_call_finished_at,
+                                    LogMetadata.ELAPSED_TIME: tool_call_finished_at - tool_call_started_at,
+                                },
+                            )
+                            tool_responses[index] = tool_response
+
+                # keep tool messages in the same order as the tool calls
+                for tool_response in tool_responses:
+                    content = tool_response["tool_response"]
+                    if content is not None:
+                        current_thoughts.append(
+                            ToolPromptMessage.model_construct(
+                                content=content if isinstance(content, str) else str(content),
+                                tool_call_id=tool_response["tool_call_id"],
+                                name=tool_response["tool_call_name"],
+                            )
+                        )
 
-            # update prompt tool
-            for prompt_tool in prompt_messages_tools:
-                if prompt_tool.name in tool_instances:
-                    self.update_prompt_message_tool(tool_instances[prompt_tool.name], prompt_tool)
-            yield self.finish_log_message(
-                log=round_log,
-                data={
-                    "output": {
-                        "llm_response": response,
-                        "tool_responses": tool_responses,
+                # update prompt tool, only the tools called in this round can have changed
+                for tool_call_name in {tool_call[1] for tool_call in tool_calls}:
+                    prompt_tool = prompt_tools_by_name.get(tool_call_name)
+                    if prompt_tool:
+                        self.update_prompt_message_tool(tool_instances[tool_call_name], prompt_tool)
+                round_finished_at = time.perf_counter()
+                yield self.finish_log_message(
+                    log=round_log,
+                    data={
+                        "output": {
+                            "llm_response": response,
+                            "tool_responses": tool_responses,
+                        },
+                    },
+                    metadata={
+                        LogMetadata.STARTED_AT: round_started_at,
+                        LogMetadata.FINISHED_AT: round_finished_at,
+                        LogMetadata.ELAPSED_TIME: round_finished_at - round_started_at,
+                        LogMetadata.TOTAL_PRICE: current_llm_usage.total_price if current_llm_usage else 0,
+                        LogMetadata.CURRENCY: current_llm_usage.currency if current_llm_usage else "",
+                        LogMetadata.TOTAL_TOKENS: current_llm_usage.total_tokens if current_llm_usage else 0,
                     },
-                },
-                metadata={
-                    LogMetadata.STARTED_AT: round_started_at,
-                    LogMetadata.FINISHED_AT: time.perf_counter(),
-                    LogMetadata.ELAPSED_TIME: time.perf_counter() - round_started_at,
-                    LogMetadata.TOTAL_PRICE: current_llm_usage.total_price if current_llm_usage else 0,
-                    LogMetadata.CURRENCY: current_llm_usage.currency if current_llm_usage else "",
-                    LogMetadata.TOTAL_TOKENS: current_llm_usage.total_tokens if current_llm_usage else 0,
-                },
+                )
+                iteration_step += 1
+
+            yield self.create_json_message(
+                {
+                    "execution_metadata": {
+                        LogMetadata.TOTAL_PRICE: llm_usage.total_price if llm_usage is not None else 0,
+                        LogMetadata.CURRENCY: llm_usage.currency if llm_usage is not None else "",
+                        LogMetadata.TOTAL_TOKENS: llm_usage.total_tokens if llm_usage is not None else 0,
+                    }
+                }
             )
-            iteration_step += 1
+        finally:
+            # the stdio servers are child processes, close the clients however the run ends
+            if mcp_future:
+                self._close_mcp_clients(mcp_future)
 
-        # All MCP Client close
-        if mcp_clients:
-            mcp_clients.close()
-
-        yield self.create_json_message(
-            {
-                "execution_metadata": {
-                    LogMetadata.TOTAL_PRICE: llm_usage["usage"].total_price if llm_usage["usage"] is not None else 0,
-                    LogMetadata.CURRENCY: llm_usage["usage"].currency if llm_usage["usage"] is not None else "",
-                    LogMetadata.TOTAL_TOKENS: llm_usage["usage"].total_tokens if llm_usage["usage"] is not None else 0,
-                }
+    @staticmethod
+    def _increase_usage(llm_usage: Optional[LLMUsage], usage: LLMUsage) -> LLMUsage:
+        """
+        Add the usage of a model call to the run usage, returns the new run usage
+        """
+        if llm_usage is None:
+            return usage
+        return llm_usage.model_copy(
+            update={
+                "prompt_tokens": llm_usage.prompt_tokens + usage.prompt_tokens,
+                "completion_tokens": llm_usage.completion_tokens + usage.completion_tokens,
+                "total_tokens": llm_usage.total_tokens + usage.total_tokens,
+                "prompt_price": llm_usage.prompt_price + usage.prompt_price,
+                "completion_price": llm_usage.completion_price + usage.completion_price,
+                "total_price": llm_usage.total_price + usage.total_price,
             }
         )
 
+    def _invoke_tool_call(
+            self,
+            tool_call: tuple[str, str, dict[str, Any], str],
+            tool_lookup: Mapping[str, tuple[str, Any]],
+            mcp_clients: McpClients | None,
+    ) -> dict[str, Any]:
+        """
+        Invoke a single tool call, safe to run in a worker thread
+        :param tool_call: (tool_call_id, tool_call_name, tool_call_args, tool_call_raw_args)
+        :param tool_lookup: tool name -> (kind, instance), kind is "tool" or "mcp"
+        :param mcp_clients: MCP Clients
+        :return: tool response
+        """
+        tool_call_id, tool_call_name, tool_call_args, tool_call_raw_args = tool_call
+        tool_kind, tool_instance = tool_lookup.get(tool_call_name, (None, None))
+        if tool_instance is None:
+            return {
+                "tool_call_id": tool_call_id,
+                "tool_call_name": tool_call_name,
+                "tool_response": f"there is not a tool named {tool_call_name}",
+                "meta": ToolInvokeMeta.error_instance(f"there is not a tool named {tool_call_name}").to_dict(),
+            }
+
+        tool_invoke_parameters = {}
+        try:
+            if tool_kind == "mcp":
+                # invoke MCP tool
+                tool_invoke_parameters = tool_call_args
+                # the raw arguments were parsed when the tool call was extracted, splice them in without re-encoding
+                result = mcp_clients.execute_tool(
+                    tool_name=tool_call_name,
+                    tool_args=orjson.Fragment(tool_call_raw_args) if tool_call_raw_args else tool_invoke_parameters,
+                )
+            else:
+                # invoke tool
+                tool_invoke_parameters = {**tool_instance.runtime_parameters, **tool_call_args}
+                tool_invoke_responses = self.session.tool.invoke(
+                    provider_type=ToolProviderType(tool_instance.provider_type),
+                    provider=tool_instance.identity.provider,
+                    tool_name=tool_instance.identity.name,
+                    parameters=tool_invoke_parameters,
+                )
+                result = ""
+                for response in tool_invoke_responses:
+                    if response.type == ToolInvokeMessage.MessageType.TEXT:
+                        result += cast(ToolInvokeMessage.TextMessage, response.message).text
+                    elif response.type == ToolInvokeMessage.MessageType.LINK:
+                        result += (
+                                f"result link: {cast(ToolInvokeMessage.TextMessage, response.message).text}."
+                                + " please tell user to check it."
+                        )
+                    elif response.type in {
+                        ToolInvokeMessage.MessageType.IMAGE_LINK,
+                        ToolInvokeMessage.MessageType.IMAGE,
+                    }:
+                        result += (
+                                "image has been created and sent to user already, "
+                                + "you do not need to create it, just tell the user to check it now."
+                        )
+                    elif response.type == ToolInvokeMessage.MessageType.JSON:
+                        text = json.dumps(
+                            cast(ToolInvokeMessage.JsonMessage, response.message).json_object,
+                            ensure_ascii=False,
+                        )
+                        result += f"tool response: {text}."
+                    else:
+                        result += f"tool response: {response.message!r}."
+        except Exception as e:
+            result = f"tool invoke error: {e!s}"
+
+        return {
+            "tool_call_id": tool_call_id,
+            "tool_call_name": tool_call_name,
+            "tool_call_input": tool_invoke_parameters,
+            "tool_response": result,
+        }
+
+    def _get_num_tokens_by_gpt2(self, prompt_messages: list[PromptMessage]) -> int:
+        """
+        Get number of tokens for given prompt messages by gpt2, counted message by message.
+        The prompt only grows between rounds, so the counts of messages seen before are reused.
+        """
+        import tiktoken
+
+        encoding = None
+        num_tokens = 0
+        for prompt_message in prompt_messages:
+            content = prompt_message.content
+            if not isinstance(content, str):
+                continue
+            content_tokens = self._prompt_tokens_cache.get(content)
+            if content_tokens is None:
+                if encoding is None:
+                    encoding = tiktoken.encoding_for_model("gpt2")
+                content_tokens = len(encoding.encode(content))
+                self._prompt_tokens_cache[content] = content_tokens
+            num_tokens += content_tokens
+        return num_tokens
+
     def check_tool_calls(self, llm_result_chunk: LLMResultChunk) -> bool:
         """
         Check if there is any tool call in llm result chunk
@@ -434,52 +540,42 @@ class FunctionCallingAgentStrategy(AgentStrategy):
         """
         return bool(llm_result.message.tool_calls)
 
-    def extract_tool_calls(self, llm_result_chunk: LLMResultChunk) -> list[tuple[str, str, dict[str, Any]]]:
+    def extract_tool_calls(self, llm_result_chunk: LLMResultChunk) -> Iterator[tuple[str, str, dict[str, Any], str]]:
         """
         Extract tool calls from llm result chunk
 
-        Returns:
-            List[Tuple[str, str, Dict[str, Any]]]: [(tool_call_id, tool_call_name, tool_call_args)]
+        Yields:
+            Tuple[str, str, Dict[str, Any], str]: (tool_call_id, tool_call_name, tool_call_args, tool_call_raw_args)
         """
-        tool_calls = []
         for prompt_message in llm_result_chunk.delta.message.tool_calls:
-            args = {}
-            if prompt_message.function.arguments != "":
-                args = json.loads(prompt_message.function.arguments)
-
-            tool_calls.append(
-                (
-                    prompt_message.id,
-                    prompt_message.function.name,
-                    args,
-                )
+            raw_args = prompt_message.function.arguments
+            args = orjson.loads(raw_args) if raw_args else {}
+
+            yield (
+                prompt_message.id,
+                prompt_message.function.name,
+                args,
+                raw_args,
             )
 
-        return tool_calls
-
-    def extract_blocking_tool_calls(self, llm_result: LLMResult) -> list[tuple[str, str, dict[str, Any]]]:
+    def extract_blocking_tool_calls(self, llm_result: LLMResult) -> Iterator[tuple[str, str, dict[str, Any], str]]:
         """
         Extract blocking tool calls from llm result
 
-        Returns:
-            List[Tuple[str, str, Dict[str, Any]]]: [(tool_call_id, tool_call_name, tool_call_args)]
+        Yields:
+            Tuple[str, str, Dict[str, Any], str]: (tool_call_id, tool_call_name, tool_call_args, tool_call_raw_args)
         """
-        tool_calls = []
         for prompt_message in llm_result.message.tool_calls:
-            args = {}
-            if prompt_message.function.arguments != "":
-                args = json.loads(prompt_message.function.arguments)
-
-            tool_calls.append(
-                (
-                    prompt_message.id,
-                    prompt_message.function.name,
-                    args,
-                )
+            raw_args = prompt_message.function.arguments
+            args = orjson.loads(raw_args) if raw_args else {}
+
+            yield (
+                prompt_message.id,
+                prompt_message.function.name,
+                args,
+                raw_args,
             )
 
-        return tool_calls
-
     def _init_system_message(self, prompt_template: str, prompt_messages: list[PromptMessage]) -> list[PromptMessage]:
         """
         Initialize system message
@@ -499,19 +595,24 @@ class FunctionCallingAgentStrategy(AgentStrategy):
         As for now, gpt supports both fc and vision at the first iteration.
         We need to remove the image messages from the prompt messages at the first iteration.
         """
-        prompt_messages = deepcopy(prompt_messages)
+        # only the rewritten user messages are copied, the others are shared
+        prompt_messages = list(prompt_messages)
 
-        for prompt_message in prompt_messages:
+        for index, prompt_message in enumerate(prompt_messages):
             if isinstance(prompt_message, UserPromptMessage) and isinstance(prompt_message.content, list):
-                prompt_message.content = "\n".join(
-                    [
-                        content.data
-                        if content.type == PromptMessageContentType.TEXT
-                        else "[image]"
-                        if content.type == PromptMessageContentType.IMAGE
-                        else "[file]"
-                        for content in prompt_message.content
-                    ]
+                prompt_messages[index] = prompt_message.model_copy(
+                    update={
+                        "content": "\n".join(
+                            [
+                                content.data
+                                if content.type == PromptMessageContentType.TEXT
+                                else "[image]"
+                                if content.type == PromptMessageContentType.IMAGE
+                                else "[file]"
+                                for content in prompt_message.content
+                            ]
+                        )
+                    }
                 )
 
         return prompt_messages
@@ -530,6 +631,30 @@ class FunctionCallingAgentStrategy(AgentStrategy):
             prompt_messages = self._clear_user_prompt_image_messages(prompt_messages)
         return prompt_messages
 
+    @staticmethod
+    def _fetch_mcp_tools(servers_config: dict[str, Any]) -> tuple[McpClients, list[dict]]:
+        """
+        Connect to the MCP servers and fetch their tools
+        """
+        mcp_clients = McpClients(servers_config)
+        try:
+            return mcp_clients, mcp_clients.fetch_tools()
+        except Exception:
+            mcp_clients.close()
+            raise
+
+    @staticmethod
+    def _close_mcp_clients(mcp_future: Future) -> None:
+        """
+        Close the MCP clients of a fetch, waits for a fetch that is still running
+        """
+
+        def close(future: Future) -> None:
+            if not future.cancelled() and future.exception() is None:
+                future.result()[0].close()
+
+        mcp_future.add_done_callback(close)
+
     @staticmethod
     def _init_prompt_mcp_tools(mcp_tools: list[dict]) -> list[PromptMessageTool]:
         """
@@ -538,14 +663,11 @@ class FunctionCallingAgentStrategy(AgentStrategy):
         prompt_messages_tools = []
 
         for tool in mcp_tools:
-            parameters = tool.get("inputSchema")
-            if "properties" not in parameters:
-                parameters["properties"] = {}
-            if "required" not in parameters:
-                parameters["required"] = []
-            prompt_message = PromptMessageTool(
+            # build a new dict, the MCP tool descriptors must stay untouched
+            parameters = {"properties": {}, "required": [], **(tool.get("inputSchema") or {})}
+            prompt_message = PromptMessageTool.model_construct(
                 name=tool.get("name"),
-                description=tool.get("description", ""),
+                description=tool.get("description") or "",
                 parameters=parameters,
             )
             prompt_messages_tools.append(prompt_message)
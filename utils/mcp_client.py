@@ -1,12 +1,16 @@
-import json
 import logging
+import os
+import subprocess
 from abc import ABC, abstractmethod
-from queue import Queue, Empty
-from threading import Event, Thread
-from typing import Any
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import count
+from threading import Event, Lock, Thread
+from typing import Any, Callable
 from urllib.parse import urljoin, urlparse
 
 import httpx
+import orjson
 from httpx import Response
 from httpx_sse import connect_sse
 
@@ -27,15 +31,73 @@ class McpClient(ABC):
         raise NotImplementedError
 
     @abstractmethod
-    def call_tool(self, tool_name: str, tool_args: dict):
+    def call_tool(self, tool_name: str, tool_args: dict | orjson.Fragment):
         raise NotImplementedError
 
 
+PROTOCOL_VERSION = "2024-11-05"
+
+# the notification never changes, build it once for every client
+INITIALIZED_NOTIFICATION = {
+    "jsonrpc": "2.0",
+    "method": "notifications/initialized",
+    "params": {}
+}
+
+
 def remove_request_params(url: str) -> str:
     return urljoin(url, urlparse(url).path)
 
 
-class McpSseClient(McpClient):
+class PendingRequestsMixin:
+    """
+    Pending JSON-RPC requests by id, resolved by the client's listener thread.
+    Once the listener has finished, new requests are refused instead of waiting for a response that never comes.
+    """
+
+    name: str
+
+    def _init_pending(self) -> None:
+        self._pending: dict[Any, Future] = {}
+        self._pending_lock = Lock()
+        self._listener_error: Exception | None = None
+
+    def _resolve_pending(self, message: dict) -> None:
+        with self._pending_lock:
+            future = self._pending.pop(message.get("id"), None)
+        if future:
+            future.set_result(message)
+        else:
+            logging.debug("%s - Ignored server message without pending request: %s", self.name, message)
+
+    def _fail_pending(self, exception: Exception) -> None:
+        """Called by the listener when it finishes, fails the pending requests and refuses new ones."""
+        with self._pending_lock:
+            self._listener_error = exception
+            futures = list(self._pending.values())
+            self._pending.clear()
+        for future in futures:
+            future.set_exception(exception)
+
+    def _request(self, data: dict, send: Callable[[dict], None], timeout: float | None) -> dict:
+        # register before sending, the response may arrive before the send returns
+        message_id = data["id"]
+        future = Future()
+        with self._pending_lock:
+            if self._listener_error:
+                raise ConnectionError(str(self._listener_error))
+            self._pending[message_id] = future
+        try:
+            send(data)
+            return future.result(timeout=timeout)
+        except TimeoutError:
+            raise TimeoutError(f"{self.name} - MCP Server response timed out")
+        finally:
+            with self._pending_lock:
+                self._pending.pop(message_id, None)
+
+
+class McpSseClient(PendingRequestsMixin, McpClient):
     """
     HTTP with SSE transport MCP client.
     """
@@ -44,17 +106,27 @@ class McpSseClient(McpClient):
                  headers: dict[str, Any] | None = None,
                  timeout: float = 50,
                  sse_read_timeout: float = 50,
+                 client: httpx.Client | None = None,
                  ):
         self.name = name
         self.url = url
+        # url without query params (they may carry credentials), safe to log
+        self._display_url = remove_request_params(url)
+        url_parsed = urlparse(url)
+        self._url_scheme = url_parsed.scheme
+        self._url_netloc = url_parsed.netloc
+        self._url_origin = f"{url_parsed.scheme}://{url_parsed.netloc}"
+        self.headers = headers or {}
         self.timeout = timeout
         self.sse_read_timeout = sse_read_timeout
         self.endpoint_url = None
-        self.client = httpx.Client(headers=headers)
-        self._request_id = 0
-        self.message_queue = Queue()
-        self.response_ready = Event()
+        # a shared client is closed by its owner, not by this MCP client
+        self._owns_client = client is None
+        self.client = client or httpx.Client(http2=True)
+        self._id_counter = count()
+        self._init_pending()
         self.should_stop = Event()
+        self._event_source = None
         self._listen_thread = None
         self._connected = Event()
         self._error_event = Event()
@@ -63,42 +135,53 @@ class McpSseClient(McpClient):
 
     def _listen_messages(self) -> None:
         try:
-            logging.info(f"{self.name} - Connecting to SSE endpoint: {remove_request_params(self.url)}")
+            logging.info("%s - Connecting to SSE endpoint: %s", self.name, self._display_url)
             with connect_sse(
                     client=self.client,
                     method="GET",
                     url=self.url,
+                    headers={**self.headers},
                     timeout=httpx.Timeout(self.timeout, read=self.sse_read_timeout),
             ) as event_source:
+                self._event_source = event_source
                 event_source.response.raise_for_status()
-                logging.debug(f"{self.name} - SSE connection established")
+                logging.debug("%s - SSE connection established", self.name)
                 for sse in event_source.iter_sse():
-                    logging.debug(f"{self.name} - Received SSE event: {sse.event}")
+                    logging.debug("%s - Received SSE event: %s", self.name, sse.event)
                     if self.should_stop.is_set():
                         break
                     match sse.event:
                         case "endpoint":
-                            self.endpoint_url = urljoin(self.url, sse.data)
-                            logging.info(f"{self.name} - Received endpoint URL: {self.endpoint_url}")
+                            if sse.data.startswith("/") and not sse.data.startswith("//"):
+                                # path relative endpoint, same origin by construction
+                                endpoint_url = self._url_origin + sse.data
+                            else:
+                                endpoint_url = urljoin(self.url, sse.data)
+                                endpoint_parsed = urlparse(endpoint_url)
+                                if (self._url_netloc != endpoint_parsed.netloc
+                                        or self._url_scheme != endpoint_parsed.scheme):
+                                    error_msg = f"{self.name} - Endpoint origin does not match connection origin: {endpoint_url}"
+                                    logging.error(error_msg)
+                                    raise ValueError(error_msg)
+                            # only publish the endpoint once its origin is checked
+                            self.endpoint_url = endpoint_url
+                            logging.info("%s - Received endpoint URL: %s", self.name, self.endpoint_url)
                             self._connected.set()
-                            url_parsed = urlparse(self.url)
-                            endpoint_parsed = urlparse(self.endpoint_url)
-                            if (url_parsed.netloc != endpoint_parsed.netloc
-                                    or url_parsed.scheme != endpoint_parsed.scheme):
-                                error_msg = f"{self.name} - Endpoint origin does not match connection origin: {self.endpoint_url}"
-                                logging.error(error_msg)
-                                raise ValueError(error_msg)
                         case "message":
-                            message = json.loads(sse.data)
-                            logging.debug(f"{self.name} - Received server message: {message}")
-                            self.message_queue.put(message)
-                            self.response_ready.set()
+                            message = orjson.loads(sse.data)
+                            logging.debug("%s - Received server message: %s", self.name, message)
+                            self._resolve_pending(message)
                         case _:
-                            logging.warning(f"{self.name} - Unknown SSE event: {sse.event}")
+                            logging.warning("%s - Unknown SSE event: %s", self.name, sse.event)
         except Exception as e:
+            if self.should_stop.is_set():
+                # the stream was closed by close()
+                return
             self._thread_exception = e
             self._error_event.set()
             self._connected.set()
+        finally:
+            self._fail_pending(ConnectionError(f"{self.name} - MCP Server SSE connection closed"))
 
     def send_message(self, data: dict):
         if not self.endpoint_url:
@@ -106,30 +189,23 @@ class McpSseClient(McpClient):
                 raise ConnectionError(f"{self.name} - MCP Server connection failed: {self._thread_exception}")
             else:
                 raise RuntimeError(f"{self.name} - Please call connect() first")
-        logging.debug(f"{self.name} - Sending client message: {data}")
+        logging.debug("%s - Sending client message: %s", self.name, data)
+        if "id" not in data:
+            self._post_message(data)
+            return {}
+        # no deadline here, a long tool call is fine while the stream stays alive,
+        # sse_read_timeout already ends the listener (and so this request) on an idle stream
+        return self._request(data, self._post_message, None)
+
+    def _post_message(self, data: dict) -> None:
         response = self.client.post(
             url=self.endpoint_url,
-            json=data,
-            headers={'Content-Type': 'application/json'},
+            content=orjson.dumps(data),
+            headers={**self.headers, 'Content-Type': 'application/json'},
             timeout=self.timeout
         )
         response.raise_for_status()
-        logging.debug(f"{self.name} - Client message sent successfully: {response.status_code}")
-        if "id" in data:
-            message_id = data["id"]
-            while True:
-                self.response_ready.wait()
-                self.response_ready.clear()
-                try:
-                    while True:
-                        message = self.message_queue.get_nowait()
-                        if "id" in message and message["id"] == message_id:
-                            self._request_id += 1
-                            return message
-                        self.message_queue.put(message)
-                except Empty:
-                    pass
-        return {}
+        logging.debug("%s - Client message sent successfully: %s", self.name, response.status_code)
 
     def connect(self) -> None:
         self._listen_thread = Thread(target=self._listen_messages, daemon=True)
@@ -149,19 +225,27 @@ class McpSseClient(McpClient):
     def close(self) -> None:
         try:
             self.should_stop.set()
-            self.client.close()
+            # unblock the listener, iter_sse() would otherwise wait for the next server event
+            if self._event_source:
+                self._event_source.response.close()
+            if self._owns_client:
+                self.client.close()
             if self._listen_thread and self._listen_thread.is_alive():
                 self._listen_thread.join(timeout=10)
         except Exception as e:
             raise Exception(f"{self.name} - MCP Server connection close failed: {str(e)}")
 
+    def _next_id(self) -> int:
+        # next() on itertools.count is atomic, so concurrent requests never share an id
+        return next(self._id_counter)
+
     def initialize(self):
         init_data = {
             "jsonrpc": "2.0",
-            "id": self._request_id,
+            "id": self._next_id(),
             "method": "initialize",
             "params": {
-                "protocolVersion": "2024-11-05",
+                "protocolVersion": PROTOCOL_VERSION,
                 "capabilities": {},
                 "clientInfo": {
                     "name": "MCP HTTP with SSE Client",
@@ -172,19 +256,14 @@ class McpSseClient(McpClient):
         response = self.send_message(init_data)
         if "error" in response:
             raise Exception(f"MCP Server initialize error: {response['error']}")
-        notify_data = {
-            "jsonrpc": "2.0",
-            "method": "notifications/initialized",
-            "params": {}
-        }
-        response = self.send_message(notify_data)
+        response = self.send_message(INITIALIZED_NOTIFICATION)
         if "error" in response:
             raise Exception(f"MCP Server notifications/initialized error: {response['error']}")
 
     def list_tools(self):
         tools_data = {
             "jsonrpc": "2.0",
-            "id": self._request_id,
+            "id": self._next_id(),
             "method": "tools/list",
             "params": {}
         }
@@ -193,10 +272,10 @@ class McpSseClient(McpClient):
             raise Exception(f"MCP Server tools/list error: {response['error']}")
         return response.get("result", {}).get("tools", [])
 
-    def call_tool(self, tool_name: str, tool_args: dict):
+    def call_tool(self, tool_name: str, tool_args: dict | orjson.Fragment):
         call_data = {
             "jsonrpc": "2.0",
-            "id": self._request_id,
+            "id": self._next_id(),
             "method": "tools/call",
             "params": {
                 "name": tool_name,
@@ -217,40 +296,50 @@ class McpStreamableHttpClient(McpClient):
     def __init__(self, name: str, url: str,
                  headers: dict[str, Any] | None = None,
                  timeout: float = 50,
+                 client: httpx.Client | None = None,
                  ):
         self.name = name
         self.url = url
+        self.headers = headers or {}
         self.timeout = timeout
-        self.client = httpx.Client(headers=headers)
+        self._owns_client = client is None
+        self.client = client or httpx.Client(http2=True)
         self.session_id = None
+        self._id_counter = count()
 
     def close(self) -> None:
         try:
-            self.client.close()
+            if self._owns_client:
+                self.client.close()
         except Exception as e:
             raise Exception(f"{self.name} - MCP Server connection close failed: {str(e)}")
 
     def send_message(self, data: dict) -> Response:
-        headers = {"Content-Type": "application/json"}
+        headers = {**self.headers, "Content-Type": "application/json"}
         if self.session_id:
             headers["Mcp-Session-Id"] = self.session_id
-        logging.debug(f"{self.name} - Sending client message: {data}")
+        logging.debug("%s - Sending client message: %s", self.name, data)
         response = self.client.post(
             url=self.url,
-            json=data,
+            content=orjson.dumps(data),
             headers=headers,
             timeout=self.timeout
         )
-        logging.debug(f"{self.name} - Client message sent successfully: {response.status_code}")
+        # fail on HTTP errors before the body is parsed as JSON-RPC
+        response.raise_for_status()
+        logging.debug("%s - Client message sent successfully: %s", self.name, response.status_code)
         return response
 
+    def _next_id(self) -> int:
+        return next(self._id_counter)
+
     def initialize(self):
         init_data = {
             "jsonrpc": "2.0",
-            "id": 0,
+            "id": self._next_id(),
             "method": "initialize",
             "params": {
-                "protocolVersion": "2024-11-05",
+                "protocolVersion": PROTOCOL_VERSION,
                 "capabilities": {},
                 "clientInfo": {
                     "name": "MCP Streamable HTTP Client",
@@ -260,33 +349,28 @@ class McpStreamableHttpClient(McpClient):
         }
         response = self.send_message(init_data)
         self.session_id = response.headers.get("mcp-session-id", None)
-        response_data = response.json()
+        response_data = orjson.loads(response.content)
         if "error" in response_data:
             raise Exception(f"MCP Server initialize error: {response_data['error']}")
-        notify_data = {
-            "jsonrpc": "2.0",
-            "method": "notifications/initialized",
-            "params": {}
-        }
-        self.send_message(notify_data)
+        self.send_message(INITIALIZED_NOTIFICATION)
 
     def list_tools(self):
         tools_data = {
             "jsonrpc": "2.0",
-            "id": 1,
+            "id": self._next_id(),
             "method": "tools/list",
             "params": {}
         }
         response = self.send_message(tools_data)
-        response_data = response.json()
+        response_data = orjson.loads(response.content)
         if "error" in response_data:
             raise Exception(f"MCP Server tools/list error: {response_data['error']}")
         return response_data.get("result", {}).get("tools", [])
 
-    def call_tool(self, tool_name: str, tool_args: dict):
+    def call_tool(self, tool_name: str, tool_args: dict | orjson.Fragment):
         call_data = {
             "jsonrpc": "2.0",
-            "id": 2,
+            "id": self._next_id(),
             "method": "tools/call",
             "params": {
                 "name": tool_name,
@@ -294,35 +378,236 @@ class McpStreamableHttpClient(McpClient):
             }
         }
         response = self.send_message(call_data)
-        response_data = response.json()
+        response_data = orjson.loads(response.content)
         if "error" in response_data:
             raise Exception(f"MCP Server tools/call error: {response_data['error']}")
         return response_data.get("result", {}).get("content", [])
 
 
+class McpStdioClient(PendingRequestsMixin, McpClient):
+    """
+    stdio transport MCP client.
+    The server command is spawned once and kept alive until close().
+    """
+
+    def __init__(self, name: str, command: str,
+                 args: list[str] | None = None,
+                 env: dict[str, str] | None = None,
+                 timeout: float = 50,
+                 ):
+        self.name = name
+        self.command = command
+        self.args = args or []
+        self.env = env
+        self.timeout = timeout
+        self.process = None
+        self._id_counter = count()
+        self._init_pending()
+        self._write_lock = Lock()
+        self._listen_thread = None
+        # the last stderr lines, reported when the process exits
+        self._stderr_tail: deque[str] = deque(maxlen=10)
+        self._stderr_thread = None
+        self.connect()
+
+    def _listen_messages(self) -> None:
+        try:
+            for line in self.process.stdout:
+                if not line.strip():
+                    continue
+                try:
+                    message = orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    message = None
+                if not isinstance(message, dict):
+                    # servers may print banners or logs to stdout, skip them and keep reading
+                    logging.warning("%s - Ignored non JSON-RPC output: %s", self.name, line.decode(errors="replace").rstrip())
+                    continue
+                logging.debug("%s - Received server message: %s", self.name, message)
+                self._resolve_pending(message)
+        except Exception as e:
+            logging.error("%s - MCP Server stdout read failed: %s", self.name, e)
+        finally:
+            # give the stderr reader a moment to catch the last lines of a crashing server
+            if self._stderr_thread:
+                self._stderr_thread.join(timeout=1)
+            self._fail_pending(ConnectionError(
+                f"{self.name} - MCP Server process closed its output{self._stderr_detail()}"))
+
+    def _drain_stderr(self) -> None:
+        try:
+            for line in self.process.stderr:
+                text = line.decode(errors="replace").rstrip()
+                if text:
+                    self._stderr_tail.append(text)
+                    logging.info("%s - MCP Server stderr: %s", self.name, text)
+        except Exception as e:
+            logging.debug("%s - MCP Server stderr read failed: %s", self.name, e)
+
+    def _stderr_detail(self) -> str:
+        if not self._stderr_tail:
+            return ""
+        return ", stderr: " + " | ".join(self._stderr_tail)
+
+    def connect(self) -> None:
+        logging.info("%s - Starting MCP Server command: %s", self.name, self.command)
+        try:
+            self.process = subprocess.Popen(
+                [self.command, *self.args],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                env={**os.environ, **self.env} if self.env else None,
+            )
+        except OSError as e:
+            raise ConnectionError(f"{self.name} - MCP Server command start failed: {e}") from e
+        self._stderr_thread = Thread(target=self._drain_stderr, daemon=True)
+        self._stderr_thread.start()
+        self._listen_thread = Thread(target=self._listen_messages, daemon=True)
+        self._listen_thread.start()
+
+    def send_message(self, data: dict):
+        if self.process.poll() is not None:
+            raise ConnectionError(f"{self.name} - MCP Server process exited with code "
+                                  f"{self.process.returncode}{self._stderr_detail()}")
+        logging.debug("%s - Sending client message: %s", self.name, data)
+        if "id" not in data:
+            self._write_message(data)
+            return {}
+        return self._request(data, self._write_message, self.timeout)
+
+    def _write_message(self, data: dict) -> None:
+        with self._write_lock:
+            self.process.stdin.write(orjson.dumps(data) + b"\n")
+            self.process.stdin.flush()
+
+    def close(self) -> None:
+        try:
+            if self.process and self.process.poll() is None:
+                self.process.stdin.close()
+                self.process.terminate()
+                try:
+                    self.process.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    self.process.kill()
+            if self._listen_thread and self._listen_thread.is_alive():
+                self._listen_thread.join(timeout=10)
+            if self._stderr_thread and self._stderr_thread.is_alive():
+                self._stderr_thread.join(timeout=10)
+        except Exception as e:
+            raise Exception(f"{self.name} - MCP Server process close failed: {str(e)}")
+
+    def _next_id(self) -> int:
+        return next(self._id_counter)
+
+    def initialize(self):
+        init_data = {
+            "jsonrpc": "2.0",
+            "id": self._next_id(),
+            "method": "initialize",
+            "params": {
+                "protocolVersion": PROTOCOL_VERSION,
+                "capabilities": {},
+                "clientInfo": {
+                    "name": "MCP stdio Client",
+                    "version": "1.0.0"
+                }
+            }
+        }
+        response = self.send_message(init_data)
+        if "error" in response:
+            raise Exception(f"MCP Server initialize error: {response['error']}")
+        self.send_message(INITIALIZED_NOTIFICATION)
+
+    def list_tools(self):
+        tools_data = {
+            "jsonrpc": "2.0",
+            "id": self._next_id(),
+            "method": "tools/list",
+            "params": {}
+        }
+        response = self.send_message(tools_data)
+        if "error" in response:
+            raise Exception(f"MCP Server tools/list error: {response['error']}")
+        return response.get("result", {}).get("tools", [])
+
+    def call_tool(self, tool_name: str, tool_args: dict | orjson.Fragment):
+        call_data = {
+            "jsonrpc": "2.0",
+            "id": self._next_id(),
+            "method": "tools/call",
+            "params": {
+                "name": tool_name,
+                "arguments": tool_args
+            }
+        }
+        response = self.send_message(call_data)
+        if "error" in response:
+            raise Exception(f"MCP Server tools/call error: {response['error']}")
+        return response.get("result", {}).get("content", [])
+
+
 class McpClients:
     def __init__(self, servers_config: dict[str, Any]):
         if "mcpServers" in servers_config:
             servers_config = servers_config["mcpServers"]
-        self._clients = {
-            name: self.init_client(name, config)
-            for name, config in servers_config.items()
-        }
-        for client in self._clients.values():
-            client.initialize()
+        self._clients: dict[str, McpClient] = {}
         self._tools = {}
+        self._tool_to_client: dict[str, McpClient] = {}
+        # one connection pool for all HTTP servers, connections to the same host are reused
+        # and HTTP/2 servers multiplex the SSE stream and concurrent POSTs over one connection
+        self._http_client = httpx.Client(http2=True)
+        if not servers_config:
+            return
+        # servers are independent, connect and initialize them concurrently
+        # a pool per McpClients, an unreachable server of one run never delays another run's setup
+        with ThreadPoolExecutor(max_workers=len(servers_config)) as executor:
+            futures = {
+                name: executor.submit(self._connect_client, name, config, self._http_client)
+                for name, config in servers_config.items()
+            }
+        exceptions = []
+        for name, future in futures.items():
+            if future.exception():
+                exceptions.append(future.exception())
+            else:
+                self._clients[name] = future.result()
+        if exceptions:
+            self.close()
+            raise exceptions[0]
+
+    @classmethod
+    def _connect_client(cls, name: str, config: dict[str, Any], http_client: httpx.Client | None) -> McpClient:
+        client = cls.init_client(name, config, http_client)
+        try:
+            client.initialize()
+        except Exception:
+            client.close()
+            raise
+        return client
 
     @staticmethod
-    def init_client(name: str, config: dict[str, Any]) -> McpClient:
+    def init_client(name: str, config: dict[str, Any], http_client: httpx.Client | None = None) -> McpClient:
         transport = "sse"
         if "transport" in config:
             transport = config["transport"]
+        elif "command" in config:
+            transport = "stdio"
+        if transport == "stdio":
+            return McpStdioClient(
+                name=name,
+                command=config.get("command"),
+                args=config.get("args", None),
+                env=config.get("env", None),
+                timeout=config.get("timeout", 50),
+            )
         if transport == "streamable_http":
             return McpStreamableHttpClient(
                 name=name,
                 url=config.get("url"),
                 headers=config.get("headers", None),
                 timeout=config.get("timeout", 50),
+                client=http_client,
             )
         return McpSseClient(
             name=name,
@@ -330,40 +615,45 @@ class McpClients:
             headers=config.get("headers", None),
             timeout=config.get("timeout", 50),
             sse_read_timeout=config.get("sse_read_timeout", 50),
+            client=http_client,
         )
 
     def fetch_tools(self) -> list[dict]:
+        if not self._clients:
+            return []
         try:
+            with ThreadPoolExecutor(max_workers=len(self._clients)) as executor:
+                futures = {
+                    server_name: executor.submit(client.list_tools)
+                    for server_name, client in self._clients.items()
+                }
+            # collect in config order so the tool list is stable between runs
             all_tools = []
-            for server_name, client in self._clients.items():
-                tools = client.list_tools()
+            for server_name, future in futures.items():
+                tools = future.result()
                 all_tools.extend(tools)
                 self._tools[server_name] = tools
+                for tool in tools:
+                    self._tool_to_client[tool["name"]] = self._clients[server_name]
             return all_tools
         except Exception as e:
             raise RuntimeError(f"Error fetching tools: {str(e)}")
 
-    def execute_tool(self, tool_name: str, tool_args: dict[str, Any]):
+    def execute_tool(self, tool_name: str, tool_args: dict[str, Any] | orjson.Fragment):
+        """tool_args may be an orjson.Fragment of already validated JSON, it is embedded in the request as is"""
         if not self._tools:
             self.fetch_tools()
-        tool_clients = {}
-        for server_name, tools in self._tools.items():
-            for tool in tools:
-                if server_name in self._clients:
-                    tool_clients[tool["name"]] = self._clients[server_name]
-        client = tool_clients.get(tool_name, None)
+        client = self._tool_to_client.get(tool_name)
+        if client is None:
+            error_msg = f"Error executing tool: there is not a tool named {tool_name}"
+            logging.error(error_msg)
+            return error_msg
         try:
-            if not client:
-                raise Exception(f"there is not a tool named {tool_name}")
             result = client.call_tool(tool_name, tool_args)
             if isinstance(result, dict) and "progress" in result:
                 progress = result["progress"]
                 total = result["total"]
-                percentage = (progress / total) * 100
-                logging.info(
-                    f"Progress: {progress}/{total} "
-                    f"({percentage:.1f}%)"
-                )
+                logging.info("Progress: %s/%s (%.1f%%)", progress, total, (progress / total) * 100)
             return f"Tool execution result: {result}"
         except Exception as e:
             error_msg = f"Error executing tool: {str(e)}"
@@ -371,6 +661,11 @@ class McpClients:
             return error_msg
 
     def close(self) -> None:
+        # closing the shared pool first also ends the SSE streams, so listener threads exit promptly
+        try:
+            self._http_client.close()
+        except Exception as e:
+            logging.error(e)
         for client in self._clients.values():
             try:
                 client.close()